@@ -4,12 +4,21 @@ Elitech Hub Website Server
 This script serves the Elitech Hub website locally and provides deployment options.
 """
 
+import argparse
+import errno
 import http.server
+import json
+import mmap
 import socketserver
 import os
+import posixpath
+import struct
 import sys
+import urllib.parse
 import webbrowser
 import socket
+import zipfile
+import zlib
 from pathlib import Path
 
 # Fix Windows console encoding
@@ -21,6 +30,19 @@ if sys.platform == 'win32':
 # Configuration
 PORT = 8000
 DIRECTORY = Path(__file__).parent
+ARCHIVE = DIRECTORY / "elitech-hub-deploy.zip"
+
+# First fd handed over by systemd-style socket activation (LISTEN_FDS)
+SD_LISTEN_FDS_START = 3
+
+# Linux ioctl for reading an interface's IPv4 address
+SIOCGIFADDR = 0x8915
+
+# How many consecutive ports --serve-only tries before giving up
+PORT_ATTEMPTS = 100
+
+# Fixed 10-byte gzip member header: deflate, no flags, no mtime, unknown OS
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
 
 
 class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
@@ -35,9 +57,238 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         self.send_header('Cache-Control', 'no-store, no-cache, must-revalidate')
         super().end_headers()
 
+    # Where request logs go; None means stdout
+    log_stream = None
+
     def log_message(self, format, *args):
         # Custom logging
-        print(f"[{self.log_date_time_string()}] {format % args}")
+        print(f"[{self.log_date_time_string()}] {format % args}", file=self.log_stream)
+
+
+class ServeOnlyTCPServer(socketserver.TCPServer):
+    """TCPServer for --serve-only that can rebind right after a restart"""
+
+    # On Windows SO_REUSEADDR lets two servers share a port, so leave it off
+    allow_reuse_address = sys.platform != 'win32'
+
+
+class DeploymentArchive:
+    """Memory-mapped view of the deployment ZIP with a name -> entry index.
+
+    Only the central directory is read at startup; file data stays in the
+    mapping and is sliced out on demand. If the ZIP is rebuilt while mapped,
+    refresh() notices and maps the new file.
+    """
+
+    def __init__(self, zip_path):
+        self.path = Path(zip_path)
+        self._file = None
+        self._map = None
+        self._stat = None
+        self._load()
+
+    @staticmethod
+    def _identity(st):
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _load(self):
+        self.entries = {}
+        self.skipped = []
+        self._file = open(self.path, 'rb')
+        self._stat = self._identity(os.fstat(self._file.fileno()))
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        with zipfile.ZipFile(self._file) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                if info.flag_bits & 0x1 or info.compress_type not in (
+                        zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                    self.skipped.append(info.filename)
+                    continue
+                # The local header's name/extra lengths can differ from the
+                # central directory, so read them to find where data starts
+                name_len, extra_len = struct.unpack_from(
+                    '<HH', self._map, info.header_offset + 26)
+                start = info.header_offset + 30 + name_len + extra_len
+                self.entries[info.filename] = (
+                    info.compress_type, start, info.compress_size,
+                    info.file_size, info.CRC)
+
+    def is_stale(self):
+        """True if the ZIP was replaced or rewritten in place since mapping"""
+        if self._stat is None:
+            return True
+        try:
+            return (self._identity(os.fstat(self._file.fileno())) != self._stat
+                    or self._identity(os.stat(self.path)) != self._stat)
+        except OSError:
+            return True
+
+    def refresh(self):
+        """Remap the ZIP if it changed; False if it cannot be read right now"""
+        if not self.is_stale():
+            return True
+        self.close()
+        try:
+            self._load()
+        except (OSError, ValueError, struct.error, zipfile.BadZipFile):
+            # Most likely still being written; try again on the next request
+            self.close()
+            return False
+        return True
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def raw(self, name):
+        """Return a zero-copy memoryview of an entry's stored bytes"""
+        _, start, size, _, _ = self.entries[name]
+        return memoryview(self._map)[start:start + size]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+        self._map = self._file = self._stat = None
+        self.entries = {}
+
+
+class ArchiveHTTPRequestHandler(CustomHTTPRequestHandler):
+    """Serves files straight out of a DeploymentArchive"""
+
+    archive = None
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def _resolve(self):
+        """Map the request path to (archive name, redirect location or None)
+
+        The name is None when the path escapes the site root.
+        """
+        parts = urllib.parse.urlsplit(self.path)
+        path = urllib.parse.unquote(parts.path)
+        # Collapse '.', '..' and empty segments like translate_path does
+        name = posixpath.normpath(path).lstrip('/')
+        if name == '.':
+            name = ''
+        if name == '..' or name.startswith('../'):
+            return None, None
+        if path.endswith('/') and name:
+            name += '/'
+        if name == '' or name.endswith('/'):
+            return name + 'index.html', None
+        if name not in self.archive and name + '/index.html' in self.archive:
+            # Same trailing-slash redirect SimpleHTTPRequestHandler does
+            return name, urllib.parse.urlunsplit(
+                (parts[0], parts[1], parts[2] + '/', parts[3], parts[4]))
+        return name, None
+
+    def _accepts_gzip(self):
+        """An explicit gzip q-value wins over a '*' wildcard"""
+        qvalues = {}
+        for coding in self.headers.get('Accept-Encoding', '').split(','):
+            token, _, params = coding.partition(';')
+            token = token.strip().lower()
+            if token == 'x-gzip':
+                token = 'gzip'
+            if token not in ('gzip', '*'):
+                continue
+            q = 1.0
+            key, _, value = params.replace(' ', '').partition('=')
+            if key.lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+            qvalues[token] = q
+        if 'gzip' in qvalues:
+            return qvalues['gzip'] > 0
+        return qvalues.get('*', 0) > 0
+
+    def _serve(self, send_body):
+        if not self.archive.refresh():
+            self.send_error(503, "Deployment archive changed and cannot be read yet; "
+                                 "retry once the rebuild finishes")
+            return
+        name, location = self._resolve()
+        if location is not None:
+            self.send_response(301)
+            self.send_header('Location', location)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if name is None or name not in self.archive:
+            self.send_error(404, "File not found")
+            return
+
+        method, _, compress_size, file_size, crc = self.archive.entries[name]
+        data = self.archive.raw(name)
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', self.guess_type(name))
+            if method == zipfile.ZIP_STORED:
+                chunks = [data]
+                length = file_size
+            elif self._accepts_gzip():
+                # Raw deflate stream wrapped as a gzip member, no inflating
+                trailer = struct.pack('<II', crc, file_size & 0xFFFFFFFF)
+                chunks = [GZIP_HEADER, data, trailer]
+                length = len(GZIP_HEADER) + compress_size + len(trailer)
+                self.send_header('Content-Encoding', 'gzip')
+            else:
+                # HEAD only needs the length, so skip inflating the body
+                chunks = [zlib.decompress(data, -zlib.MAX_WBITS)] if send_body else []
+                length = file_size
+            if method == zipfile.ZIP_DEFLATED:
+                self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Content-Length', str(length))
+            self.end_headers()
+            if send_body:
+                for chunk in chunks:
+                    self.wfile.write(chunk)
+        finally:
+            data.release()
+
+
+def get_interface_ips():
+    """Get this machine's IPv4 interface addresses without a route probe
+
+    On Linux the kernel is asked directly (SIOCGIFADDR). Elsewhere the
+    hostname is resolved, which normally comes from the local hosts/NetBIOS
+    tables but may fall back to DNS.
+    """
+    ips = []
+    if not sys.platform.startswith('linux'):
+        try:
+            for info in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET):
+                ip = info[4][0]
+                if ip not in ips and not ip.startswith('127.'):
+                    ips.append(ip)
+        except OSError:
+            pass
+        return ips
+    import fcntl
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        for _, name in socket.if_nameindex():
+            try:
+                ifreq = fcntl.ioctl(s.fileno(), SIOCGIFADDR,
+                                    struct.pack('256s', name[:15].encode()))
+            except OSError:
+                continue  # interface has no IPv4 address
+            ip = socket.inet_ntoa(ifreq[20:24])
+            if ip not in ips and not ip.startswith('127.'):
+                ips.append(ip)
+    return ips
 
 
 def get_local_ip():
@@ -68,6 +319,54 @@ def find_available_port(start_port=8000):
     return None
 
 
+def bind_server(handler, port, attempts=PORT_ATTEMPTS):
+    """Bind a server directly, moving up a port each time one is taken
+
+    Port 0 lets the OS pick a free port in a single attempt.
+    """
+    if port == 0:
+        attempts = 1
+    for candidate in range(port, min(port + attempts, 65536)):
+        httpd = ServeOnlyTCPServer(("", candidate), handler, bind_and_activate=False)
+        try:
+            httpd.server_bind()
+            httpd.server_activate()
+            return httpd
+        except OSError as e:
+            httpd.server_close()
+            # WinError 10013 covers Hyper-V/WSL reserved port ranges
+            if (e.errno not in (errno.EADDRINUSE, errno.EACCES)
+                    and getattr(e, 'winerror', None) != 10013):
+                raise
+    return None
+
+
+def server_from_fd(handler, fd):
+    """Wrap an inherited, already-listening socket (socket activation)
+
+    Returns None if the fd is not a TCP socket.
+    """
+    sock = socket.socket(fileno=fd)
+    if (sock.type != socket.SOCK_STREAM
+            or sock.family not in (socket.AF_INET, socket.AF_INET6)):
+        sock.detach()
+        return None
+    httpd = ServeOnlyTCPServer(None, handler, bind_and_activate=False)
+    httpd.socket.close()
+    httpd.socket = sock
+    httpd.server_address = sock.getsockname()
+    return httpd
+
+
+def inherited_fd():
+    """Return the fd passed by a systemd-style socket activator, if any"""
+    if os.environ.get('LISTEN_PID') != str(os.getpid()):
+        return None
+    if int(os.environ.get('LISTEN_FDS', '0')) < 1:
+        return None
+    return SD_LISTEN_FDS_START
+
+
 def print_banner():
     """Print a nice banner"""
     banner = """
@@ -120,19 +419,47 @@ def print_deployment_info():
     print(deployment_info)
 
 
-def start_server():
-    """Start the local development server"""
+def make_handler(archive_path=None, log=print):
+    """Pick the request handler, loading the archive if one is given"""
+    if archive_path is None:
+        if not os.path.exists('index.html'):
+            log("[ERROR] index.html not found in the current directory!")
+            log(f"Current directory: {os.getcwd()}")
+            sys.exit(1)
+        return CustomHTTPRequestHandler
+
+    if not os.path.exists(archive_path):
+        log(f"[ERROR] Archive not found: {archive_path}")
+        log("Run deploy_to_netlify.py to create it first.")
+        sys.exit(1)
+    archive = DeploymentArchive(archive_path)
+    if 'index.html' not in archive:
+        log(f"[ERROR] index.html not found in {archive.path.name}!")
+        sys.exit(1)
+    ArchiveHTTPRequestHandler.archive = archive
+    log(f"[OK] Serving {len(archive)} files from {archive.path.name}")
+    if archive.skipped:
+        log(f"[WARNING] Skipped {len(archive.skipped)} unsupported "
+            f"entries (encrypted or unknown compression)")
+    return ArchiveHTTPRequestHandler
+
+
+def start_server(archive_path=None):
+    """Start the local development server
+
+    With archive_path, the site is served from that deployment ZIP instead
+    of the working tree.
+    """
     global PORT
 
+    if archive_path is not None:
+        archive_path = os.path.abspath(archive_path)
+
     os.chdir(DIRECTORY)
 
     print_banner()
 
-    # Check if index.html exists
-    if not os.path.exists('index.html'):
-        print("[ERROR] index.html not found in the current directory!")
-        print(f"Current directory: {os.getcwd()}")
-        sys.exit(1)
+    handler = make_handler(archive_path)
 
     # Find available port
     if not check_port_available(PORT):
@@ -145,7 +472,9 @@ def start_server():
     local_ip = get_local_ip()
 
     # Create server
-    with socketserver.TCPServer(("", PORT), CustomHTTPRequestHandler) as httpd:
+    with socketserver.TCPServer(("", PORT), handler) as httpd:
+        # Port 0 means the OS picked one; show the real port
+        PORT = httpd.server_address[1]
         print("[OK] Server started successfully!\n")
         print("Access your website at:")
         print(f"   - Local:   http://localhost:{PORT}")
@@ -172,9 +501,96 @@ def start_server():
             sys.exit(0)
 
 
+def serve_only(archive_path=None, port=PORT, fd=None):
+    """Headless server for scripts: no probes, no browser, one ready line
+
+    Status messages go to stderr; stdout gets a single JSON line once the
+    socket is listening, e.g. {"status": "ready", "port": 8000, ...}.
+    """
+    if archive_path is not None:
+        archive_path = os.path.abspath(archive_path)
+
+    os.chdir(DIRECTORY)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    handler = make_handler(archive_path, log=log)
+    handler.log_stream = sys.stderr
+
+    if fd is None:
+        fd = inherited_fd()
+    if fd is not None:
+        httpd = server_from_fd(handler, fd)
+        if httpd is None:
+            log(f"[ERROR] fd {fd} is not a TCP (IPv4/IPv6) socket!")
+            sys.exit(1)
+    else:
+        httpd = bind_server(handler, port)
+        if httpd is None:
+            last = min(port + PORT_ATTEMPTS, 65536) - 1
+            log(f"[ERROR] Could not bind any port from {port} to {last}!")
+            sys.exit(1)
+
+    with httpd:
+        host, bound_port = httpd.server_address[:2]
+        if host in ('', '0.0.0.0'):
+            addresses = ['127.0.0.1'] + get_interface_ips()
+        elif host == '::':
+            addresses = ['::1']
+            # A dual-stack socket also answers on the IPv4 addresses
+            if not httpd.socket.getsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY):
+                addresses += ['127.0.0.1'] + get_interface_ips()
+        else:
+            addresses = [host]
+        urls = [f"http://[{ip}]:{bound_port}" if ':' in ip else f"http://{ip}:{bound_port}"
+                for ip in addresses]
+        print(json.dumps({
+            "status": "ready",
+            "pid": os.getpid(),
+            "port": bound_port,
+            "urls": urls,
+        }), flush=True)
+
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the Elitech Hub website locally")
+    parser.add_argument(
+        '--from-archive', nargs='?', const=str(ARCHIVE), metavar='ZIP',
+        help=f"serve from the deployment ZIP instead of the working tree "
+             f"(default: {ARCHIVE.name})")
+    parser.add_argument(
+        '--serve-only', action='store_true',
+        help="headless mode for scripts: bind directly, skip the browser "
+             "and print a JSON ready line")
+    parser.add_argument(
+        '--port', type=int, default=PORT,
+        help=f"port to listen on, 0 picks a free one (default: {PORT})")
+    parser.add_argument(
+        '--fd', type=int, metavar='N',
+        help="serve on an inherited listening socket (with --serve-only)")
+    args = parser.parse_args(argv)
+    if not 0 <= args.port <= 65535:
+        parser.error("--port must be between 0 and 65535")
+    if args.fd is not None and not args.serve_only:
+        parser.error("--fd requires --serve-only")
+    return args
+
+
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        start_server()
+        if args.serve_only:
+            serve_only(archive_path=args.from_archive, port=args.port, fd=args.fd)
+        else:
+            PORT = args.port
+            start_server(archive_path=args.from_archive)
     except Exception as e:
-        print(f"[ERROR] {str(e)}")
+        # Keep stdout machine-readable in --serve-only mode
+        print(f"[ERROR] {str(e)}", file=sys.stderr if args.serve_only else sys.stdout)
         sys.exit(1)